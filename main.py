@@ -11,236 +11,670 @@ from rich.panel import Panel
 from rich.table import Table
 from rich.prompt import Prompt, IntPrompt
 from rich.markdown import Markdown
+from rich.live import Live
+import argparse
+import asyncio
+import atexit
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from functools import wraps
+from hashlib import blake2b
+from pathlib import Path
+import inspect
 import json
+import math
+import os
+from json_repair import repair_json
+import numpy as np
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 console = Console()
 
+CACHE_DIR = Path.home() / ".creative-coach"
+CACHE_TTL = 7 * 24 * 3600
+EMBED_MODEL = "nomic-embed-text"
+SIMILARITY_THRESHOLD = 0.93
+MAX_SEMANTIC_ENTRIES = 200
+MAX_SUBMISSIONS = 50
+
+QUALITY_MODELS = {"fast": "llama3.2:3b-instruct-q4_K_M", "high": "llama3.2:3b-instruct-fp16"}
+
+# Output token caps (num_predict) per method, sized for a complete response to each schema
+# (expand_scene and dialogue_coach also write a full revised draft). A response that hits
+# its cap is marked truncated and never cached.
+BUDGET = {
+    "review_writing": 2048,
+    "analyze_element": 1536,
+    "generate_prompt": 1024,
+    "expand_scene": 2048,
+    "dialogue_coach": 2048,
+}
+SAMPLING_OPTIONS = {"temperature": 0.7, "top_p": 0.9}
+
 GENRES = ["Fiction", "Poetry", "Creative Non-Fiction", "Flash Fiction", "Short Story",
           "Personal Essay", "Memoir", "Screenplay", "Playwriting", "Children's Literature"]
 
 WRITING_ELEMENTS = ["Character", "Plot", "Setting", "Dialogue", "Theme", 
                     "Voice", "Imagery", "Pacing", "Conflict", "Structure"]
 
-
-class CreativeWritingCoach:
-    def __init__(self, model: str = "llama3.2"):
-        self.model = model
-        self.submissions = []
-    
-    def review_writing(self, text: str, genre: str = "Fiction") -> dict:
-        prompt = f"""Review this creative writing piece and provide constructive feedback.
+# Prompt skeletons, filled with str.format. The response shape is enforced separately
+# through Ollama structured output (see _json_schema), so prompts only carry the task.
+REVIEW_TMPL = """Review this creative writing piece and provide constructive feedback.
+Quote the text for examples, suggest concrete rewrites, and end with an encouraging comment.
+Scores are integers from 0 to 100. Respond with JSON matching the provided schema.
 
 Genre: {genre}
 
+Text:
+{text}"""
+
+ANALYZE_TMPL = """Analyze the {element} in this creative writing.
+Cite examples from the text, suggest practice exercises and published mentor texts to study
+for {element}. Scores are integers from 0 to 100. Respond with JSON matching the provided schema.
+
 Text:
 {text}
 
-Return JSON:
-{{
-    "overview": {{
-        "genre": "{genre}",
-        "word_count": "approximate",
-        "overall_impression": "brief overall assessment",
-        "overall_score": 75
-    }},
-    "strengths": [
-        {{
-            "element": "what's strong",
-            "example": "quote from text",
-            "why_effective": "why it works"
-        }}
-    ],
-    "areas_for_improvement": [
-        {{
-            "element": "what needs work",
-            "current_issue": "the problem",
-            "suggestion": "how to improve",
-            "example_revision": "suggested rewrite"
-        }}
-    ],
-    "craft_analysis": {{
-        "voice": {{"score": 75, "feedback": "assessment"}},
-        "imagery": {{"score": 70, "feedback": "assessment"}},
-        "dialogue": {{"score": 65, "feedback": "assessment"}},
-        "pacing": {{"score": 70, "feedback": "assessment"}},
-        "structure": {{"score": 80, "feedback": "assessment"}}
-    }},
-    "memorable_lines": ["lines that stand out positively"],
-    "lines_to_revise": [
-        {{
-            "original": "current line",
-            "issue": "what's wrong",
-            "suggested": "improved version"
-        }}
-    ],
-    "next_steps": ["prioritized revision tasks"],
-    "encouragement": "motivating closing comment"
-}}"""
+Element to Analyze: {element}"""
 
-        response = ollama.chat(model=self.model, messages=[{"role": "user", "content": prompt}])
-        result = self._parse_json(response['message']['content'])
-        self.submissions.append({"text": text[:500], "review": result})
-        return result
-    
-    def analyze_element(self, text: str, element: str) -> dict:
-        prompt = f"""Analyze the {element} in this creative writing.
+ANALYZE_FOLLOWUP_TMPL = """Analyze the {element} in this creative writing.
+Cite examples from the text and note where {element} could be stronger.
+Scores are integers from 0 to 100. Respond with JSON matching the provided schema.
 
 Text:
 {text}
 
-Element to Analyze: {element}
-
-Return JSON:
-{{
-    "element": "{element}",
-    "analysis": {{
-        "current_state": "how it's being used",
-        "effectiveness": "how well it works",
-        "score": 70
-    }},
-    "specific_observations": [
-        {{
-            "observation": "what you notice",
-            "example": "from the text",
-            "impact": "effect on reader"
-        }}
-    ],
-    "techniques_used": ["writing techniques identified"],
-    "missing_opportunities": ["where {element} could be stronger"],
-    "improvement_exercises": [
-        {{
-            "exercise": "practice activity",
-            "purpose": "what it develops",
-            "instructions": "how to do it"
-        }}
-    ],
-    "mentor_texts": ["published works to study for {element}"],
-    "revision_suggestions": ["specific changes to make"]
-}}"""
+Element to Analyze: {element}"""
 
-        response = ollama.chat(model=self.model, messages=[{"role": "user", "content": prompt}])
-        return self._parse_json(response['message']['content'])
-    
-    def generate_prompt(self, genre: str, theme: str = "", constraints: str = "") -> dict:
-        prompt = f"""Generate a creative writing prompt.
+PROMPT_TMPL = """Generate a creative writing prompt with inspiration, optional challenges,
+published works with similar prompts, tips and pitfalls to avoid.
+Respond with JSON matching the provided schema.
 
 Genre: {genre}
 Theme (if specified): {theme}
-Constraints (if any): {constraints}
-
-Return JSON:
-{{
-    "prompt": {{
-        "main_prompt": "the writing prompt",
-        "genre": "{genre}",
-        "suggested_length": "word count range",
-        "time_limit": "suggested writing time"
-    }},
-    "inspiration_elements": {{
-        "character_seeds": ["character ideas"],
-        "setting_options": ["setting ideas"],
-        "conflict_possibilities": ["potential conflicts"],
-        "opening_lines": ["possible first lines"]
-    }},
-    "optional_challenges": [
-        {{
-            "challenge": "extra constraint",
-            "purpose": "what skill it develops"
-        }}
-    ],
-    "mentor_examples": ["published works with similar prompts"],
-    "tips_for_this_prompt": ["advice specific to this prompt"],
-    "common_pitfalls": ["mistakes to avoid"]
-}}"""
+Constraints (if any): {constraints}"""
 
-        response = ollama.chat(model=self.model, messages=[{"role": "user", "content": prompt}])
-        return self._parse_json(response['message']['content'])
-    
-    def expand_scene(self, scene_summary: str) -> dict:
-        prompt = f"""Help expand this scene with more detail and craft.
+EXPAND_TMPL = """Help expand this scene with more detail and craft: sensory details,
+show-don't-tell rewrites, pacing suggestions and a more detailed draft of the scene.
+Respond with JSON matching the provided schema.
 
 Scene Summary:
-{scene_summary}
-
-Return JSON:
-{{
-    "original_summary": "{scene_summary}",
-    "expanded_elements": {{
-        "sensory_details": {{
-            "sight": ["visual details to add"],
-            "sound": ["audio details"],
-            "smell": ["scent details"],
-            "touch": ["tactile details"],
-            "taste": ["taste details if relevant"]
-        }},
-        "character_interiority": ["thoughts/feelings to explore"],
-        "setting_enrichment": ["environmental details"],
-        "dialogue_opportunities": ["conversations to develop"]
-    }},
-    "expanded_draft": "a more detailed version of the scene",
-    "show_dont_tell_opportunities": [
-        {{
-            "telling": "abstract statement",
-            "showing": "concrete scene that shows it"
-        }}
-    ],
-    "pacing_suggestions": {{
-        "slow_down": ["moments to linger on"],
-        "speed_up": ["moments to compress"]
-    }}
-}}"""
-
-        response = ollama.chat(model=self.model, messages=[{"role": "user", "content": prompt}])
-        return self._parse_json(response['message']['content'])
-    
-    def dialogue_coach(self, dialogue: str, context: str = "") -> dict:
-        prompt = f"""Coach me on improving this dialogue.
+{scene_summary}"""
+
+DIALOGUE_TMPL = """Coach me on improving this dialogue, line by line, and provide a revised version.
+Scores are integers from 0 to 100. Respond with JSON matching the provided schema.
 
 Context: {context}
 
 Dialogue:
-{dialogue}
-
-Return JSON:
-{{
-    "dialogue_analysis": {{
-        "naturalness": {{"score": 70, "assessment": "feedback"}},
-        "subtext": {{"score": 65, "assessment": "feedback"}},
-        "character_distinction": {{"score": 75, "assessment": "feedback"}},
-        "purpose": {{"score": 80, "assessment": "feedback"}}
-    }},
-    "line_by_line_feedback": [
-        {{
-            "original_line": "the line",
-            "speaker": "who says it",
-            "feedback": "what works or doesn't",
-            "revision": "improved version"
-        }}
+{dialogue}"""
+
+# Expected response shapes: dicts list their keys, one-item lists describe every item.
+_SCORED = {"score": int, "feedback": str}
+_ASSESSED = {"score": int, "assessment": str}
+
+REVIEW_SCHEMA = {
+    "overview": {"genre": str, "word_count": str, "overall_impression": str, "overall_score": int},
+    "strengths": [{"element": str, "example": str, "why_effective": str}],
+    "areas_for_improvement": [
+        {"element": str, "current_issue": str, "suggestion": str, "example_revision": str}
     ],
-    "subtext_opportunities": ["where to add unspoken meaning"],
-    "dialogue_tags": {{
-        "overused": ["tags used too much"],
-        "suggestions": ["better alternatives"]
-    }},
-    "revised_dialogue": "improved version of the dialogue",
-    "dialogue_exercises": ["practice activities"]
-}}"""
-
-        response = ollama.chat(model=self.model, messages=[{"role": "user", "content": prompt}])
-        return self._parse_json(response['message']['content'])
+    "craft_analysis": {"voice": _SCORED, "imagery": _SCORED, "dialogue": _SCORED,
+                       "pacing": _SCORED, "structure": _SCORED},
+    "memorable_lines": [str],
+    "lines_to_revise": [{"original": str, "issue": str, "suggested": str}],
+    "next_steps": [str],
+    "encouragement": str,
+}
+
+ANALYZE_SCHEMA = {
+    "element": str,
+    "analysis": {"current_state": str, "effectiveness": str, "score": int},
+    "specific_observations": [{"observation": str, "example": str, "impact": str}],
+    "techniques_used": [str],
+    "missing_opportunities": [str],
+    "improvement_exercises": [{"exercise": str, "purpose": str, "instructions": str}],
+    "mentor_texts": [str],
+    "revision_suggestions": [str],
+}
+
+PROMPT_SCHEMA = {
+    "prompt": {"main_prompt": str, "genre": str, "suggested_length": str, "time_limit": str},
+    "inspiration_elements": {"character_seeds": [str], "setting_options": [str],
+                             "conflict_possibilities": [str], "opening_lines": [str]},
+    "optional_challenges": [{"challenge": str, "purpose": str}],
+    "mentor_examples": [str],
+    "tips_for_this_prompt": [str],
+    "common_pitfalls": [str],
+}
+
+EXPAND_SCHEMA = {
+    "original_summary": str,
+    "expanded_elements": {
+        "sensory_details": {"sight": [str], "sound": [str], "smell": [str],
+                            "touch": [str], "taste": [str]},
+        "character_interiority": [str],
+        "setting_enrichment": [str],
+        "dialogue_opportunities": [str],
+    },
+    "expanded_draft": str,
+    "show_dont_tell_opportunities": [{"telling": str, "showing": str}],
+    "pacing_suggestions": {"slow_down": [str], "speed_up": [str]},
+}
+
+ANALYZE_FOLLOWUP_SCHEMA = {key: value for key, value in ANALYZE_SCHEMA.items()
+                           if key not in ("element", "mentor_texts", "improvement_exercises")}
+
+DIALOGUE_SCHEMA = {
+    "dialogue_analysis": {"naturalness": _ASSESSED, "subtext": _ASSESSED,
+                          "character_distinction": _ASSESSED, "purpose": _ASSESSED},
+    "line_by_line_feedback": [{"original_line": str, "speaker": str, "feedback": str, "revision": str}],
+    "subtext_opportunities": [str],
+    "dialogue_tags": {"overused": [str], "suggestions": [str]},
+    "revised_dialogue": str,
+    "dialogue_exercises": [str],
+}
+
+
+# Changing any prompt, schema or token budget retires the responses cached for the old ones.
+PROMPT_VERSION = blake2b(repr((
+    REVIEW_TMPL, ANALYZE_TMPL, ANALYZE_FOLLOWUP_TMPL, PROMPT_TMPL, EXPAND_TMPL, DIALOGUE_TMPL,
+    REVIEW_SCHEMA, ANALYZE_SCHEMA, PROMPT_SCHEMA, EXPAND_SCHEMA, DIALOGUE_SCHEMA, BUDGET,
+    SAMPLING_OPTIONS,
+)).encode("utf-8"), digest_size=8).hexdigest()
+
+
+class PrefetchCancelled(Exception):
+    """Raised inside a background prefetch once the coach is closing."""
+
+
+class ResponseCache:
+    """Persistent exact-match cache of parsed model responses."""
+
+    def __init__(self, path: Path = CACHE_DIR / "responses.sqlite3", ttl: int = CACHE_TTL):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+        self.conn.execute("DELETE FROM responses WHERE expires <= ?", (time.time(),))
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(model: str, method: str, prompt: str) -> str:
+        payload = json.dumps([model, method, PROMPT_VERSION, prompt])
+        return blake2b(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value FROM responses WHERE key = ? AND expires > ?", (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: dict):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + self.ttl),
+            )
+            self.conn.commit()
+
+
+class SemanticCache:
+    """Nearest-neighbour cache over local embeddings for lightly edited resubmissions."""
+
+    def __init__(self, path: Path = CACHE_DIR / "semantic", threshold: float = SIMILARITY_THRESHOLD,
+                 embed_model: str = EMBED_MODEL, client: ollama.Client = None,
+                 max_entries: int = MAX_SEMANTIC_ENTRIES, ttl: int = CACHE_TTL):
+        path.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.client = client or ollama.Client()
+        self.threshold = threshold
+        self.embed_model = embed_model
+        self.lock = threading.Lock()
+        self.spaces = {}
+
+    def embed(self, text: str):
+        try:
+            response = self.client.embeddings(model=self.embed_model, prompt=text)
+        except ollama.ResponseError:
+            return None
+        vector = np.asarray(response["embedding"], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _space(self, namespace: str):
+        if namespace not in self.spaces:
+            path = self.path / (blake2b(namespace.encode("utf-8"), digest_size=16).hexdigest() + ".npz")
+            space = {"path": path, "matrix": None, "expires": np.empty(0), "results": []}
+            if path.exists():
+                try:
+                    with np.load(path) as data:
+                        matrix, expires = data["matrix"], data["expires"]
+                        results = json.loads(str(data["results"]))
+                except (OSError, ValueError, KeyError):
+                    matrix, expires, results = None, None, None
+                if matrix is not None and len(matrix) == len(expires) == len(results):
+                    live = expires > time.time()
+                    if live.any():
+                        space.update(matrix=matrix[live], expires=expires[live],
+                                     results=[r for r, keep in zip(results, live) if keep])
+            self.spaces[namespace] = space
+        return self.spaces[namespace]
+
+    def lookup(self, namespace: str, embedding):
+        with self.lock:
+            space = self._space(namespace)
+            matrix, results = space["matrix"], space["results"]
+        if embedding is None or matrix is None or matrix.shape[1] != embedding.shape[0]:
+            return None
+        sims = matrix @ embedding
+        best = int(np.argmax(sims))
+        return results[best] if sims[best] > self.threshold else None
+
+    def add(self, namespace: str, embedding, result: dict):
+        if embedding is None or not _cacheable(result):
+            return
+        with self.lock:
+            space = self._space(namespace)
+            matrix, expires, results = space["matrix"], space["expires"], space["results"]
+            expiry = time.time() + self.ttl
+            if matrix is None or matrix.shape[1] != embedding.shape[0]:
+                matrix, expires, results = embedding[None, :], np.array([expiry]), [result]
+            else:
+                # Keep only the newest max_entries so lookups and rewrites stay bounded.
+                keep = self.max_entries - 1
+                matrix = np.vstack([matrix[len(matrix) - keep:], embedding])
+                expires = np.append(expires[len(expires) - keep:], expiry)
+                results = results[len(results) - keep:] + [result]
+            space.update(matrix=matrix, expires=expires, results=results)
+            # Matrix and results go into one file that is swapped in atomically.
+            tmp = space["path"].with_suffix(".tmp")
+            with open(tmp, "wb") as f:
+                np.savez(f, matrix=matrix, expires=expires, results=np.array(json.dumps(results)))
+            os.replace(tmp, space["path"])
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    """Fixed prompt skeleton: which slots vary and which response fields are slot-only."""
+    method: str
+    slot_names: tuple
+    shared_fields: tuple = ()
+
+    def slot_key(self, **slots) -> str:
+        return json.dumps([_normalize(slots[name]) for name in self.slot_names])
+
+
+# mentor_texts and improvement_exercises depend only on the element, not the text.
+ELEMENT_TEMPLATE = PromptTemplate("analyze_element", ("element",),
+                                  shared_fields=("mentor_texts", "improvement_exercises"))
+
+
+_ELEMENT_NAMES = {element.lower(): element for element in WRITING_ELEMENTS}
+
+
+def canonical_element(name: str) -> str:
+    """Spell a craft element as in WRITING_ELEMENTS so typed names share cache keys."""
+    name = name.strip()
+    return _ELEMENT_NAMES.get(name.lower(), name)
+
+
+def _cacheable(result: dict) -> bool:
+    """Only complete, parsed responses are worth serving again."""
+    return "raw_response" not in result and not result.get("truncated")
+
+
+def _normalize(value) -> str:
+    """Strip trailing whitespace and collapse space runs so reformatted input still hits."""
+    lines = (re.sub(r"[ \t]+", " ", line).rstrip() for line in str(value).strip().splitlines())
+    return "\n".join(lines)
+
+
+_loads = orjson.loads if orjson is not None else json.loads
+
+
+def _pretty(data) -> str:
+    """Indent a result for display, using orjson when it is installed."""
+    if orjson is None:
+        return json.dumps(data, indent=2, ensure_ascii=False)
+    return orjson.dumps(data, option=orjson.OPT_INDENT_2).decode()
+
+
+def _json_schema(schema) -> dict:
+    """Translate a response shape into the JSON Schema passed to Ollama's format option."""
+    if isinstance(schema, dict):
+        return {"type": "object", "properties": {key: _json_schema(sub) for key, sub in schema.items()},
+                "required": list(schema)}
+    if isinstance(schema, list):
+        return {"type": "array", "items": _json_schema(schema[0])}
+    return {"type": "integer" if schema is int else "string"}
+
+
+def _conform(value, schema):
+    """Coerce a parsed value to a schema, filling missing keys with empty defaults (None for scores)."""
+    if isinstance(schema, dict):
+        value = value if isinstance(value, dict) else {}
+        result = {key: _conform(value.get(key), sub) for key, sub in schema.items()}
+        result.update((key, item) for key, item in value.items() if key not in schema)
+        return result
+    if isinstance(schema, list):
+        if value is None:
+            return []
+        return [_conform(item, schema[0]) for item in (value if isinstance(value, list) else [value])]
+    if schema is int:
+        # Every integer field is a 0-100 score; None marks one the model did not give.
+        if isinstance(value, str):
+            match = re.search(r"-?\d+(?:\.\d+)?", value)
+            value = float(match.group()) if match else None
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or not math.isfinite(value):
+            return None
+        return min(max(int(value), 0), 100)
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return "\n".join(_conform(item, str) for item in value)
+    if isinstance(value, dict):
+        return json.dumps(value, ensure_ascii=False)
+    return value if isinstance(value, str) else str(value)
+
+
+def _args_key(func, args, kwargs) -> str:
+    """Key a coach method call by its bound arguments, so defaults and keywords agree."""
+    bound = inspect.signature(func).bind(None, *args, **kwargs)
+    bound.apply_defaults()
+    values = [(name, _normalize(value)) for name, value in list(bound.arguments.items())[1:]
+              if name != "on_chunk"]
+    return json.dumps(values)
+
+
+def cached(method_name: str):
+    """Serve a coach method from the response cache, calling the model only on a miss."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            key = self.cache.make_key(self.model, method_name, _args_key(func, args, kwargs))
+            result = self.cache.get(key)
+            if result is None:
+                result = func(self, *args, **kwargs)
+                if _cacheable(result):
+                    self.cache.set(key, result)
+            return result
+        return wrapper
+    return decorator
+
+
+class CreativeWritingCoach:
+    def __init__(self, model: str = QUALITY_MODELS["fast"], cache: ResponseCache = None,
+                 semantic_cache: SemanticCache = None):
+        self.model = model
+        self._client = ollama.Client()
+        self.cache = cache or ResponseCache()
+        self.semantic_cache = semantic_cache or SemanticCache(client=self._client)
+        self.submissions = deque(maxlen=MAX_SUBMISSIONS)
+        self._prefetch_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+        self._prefetches = {}
+        self._closing = threading.Event()
+        atexit.register(self.close)
     
-    def _parse_json(self, content: str) -> dict:
+    @cached("review_writing")
+    def review_writing(self, text: str, genre: str = "Fiction", on_chunk=None) -> dict:
+        namespace = f"{self.model}|{PROMPT_VERSION}|review_writing|{genre}"
+        embedding = self.semantic_cache.embed(text)
+        result = self.semantic_cache.lookup(namespace, embedding)
+        if result is not None:
+            return result
+
+        prompt = self._review_prompt(text, genre)
+
+        result = self._ask(prompt, "review_writing", REVIEW_SCHEMA, on_chunk)
+        self.submissions.append({"text": text[:500], "review": result})
+        self.semantic_cache.add(namespace, embedding, result)
+        return result
+    
+    @cached("analyze_element")
+    def analyze_element(self, text: str, element: str, on_chunk=None) -> dict:
+        namespace = f"{self.model}|{PROMPT_VERSION}|analyze_element|{element}"
+        embedding = self.semantic_cache.embed(text)
+        result = self.semantic_cache.lookup(namespace, embedding)
+        if result is not None:
+            return result
+
+        template = ELEMENT_TEMPLATE
+        shared = self._shared_sections(template, element=element)
+        if shared is not None:
+            prompt = ANALYZE_FOLLOWUP_TMPL.format(text=text, element=element)
+
+            result = {**self._ask(prompt, "analyze_element", ANALYZE_FOLLOWUP_SCHEMA, on_chunk),
+                      "element": element}
+            if "raw_response" not in result:
+                result.update(shared)
+            result = _conform(result, ANALYZE_SCHEMA)
+            self.semantic_cache.add(namespace, embedding, result)
+            return result
+
+        prompt = self._element_prompt(text, element)
+
+        result = self._ask(prompt, "analyze_element", ANALYZE_SCHEMA, on_chunk)
+        self._store_shared_sections(template, result, element=element)
+        self.semantic_cache.add(namespace, embedding, result)
+        return result
+    
+    @cached("generate_prompt")
+    def generate_prompt(self, genre: str, theme: str = "", constraints: str = "",
+                        on_chunk=None) -> dict:
+        prompt = PROMPT_TMPL.format(genre=genre, theme=theme, constraints=constraints)
+
+        return self._ask(prompt, "generate_prompt", PROMPT_SCHEMA, on_chunk)
+    
+    @cached("expand_scene")
+    def expand_scene(self, scene_summary: str, on_chunk=None) -> dict:
+        prompt = EXPAND_TMPL.format(scene_summary=scene_summary)
+
+        return self._ask(prompt, "expand_scene", EXPAND_SCHEMA, on_chunk)
+    
+    @cached("dialogue_coach")
+    def dialogue_coach(self, dialogue: str, context: str = "", on_chunk=None) -> dict:
+        prompt = DIALOGUE_TMPL.format(dialogue=dialogue, context=context)
+
+        return self._ask(prompt, "dialogue_coach", DIALOGUE_SCHEMA, on_chunk)
+    
+    def _review_prompt(self, text: str, genre: str) -> str:
+        return REVIEW_TMPL.format(genre=genre, text=text)
+
+    def _element_prompt(self, text: str, element: str) -> str:
+        return ANALYZE_TMPL.format(text=text, element=element)
+
+    async def _chat_async(self, client, prompt: str, method: str, schema: dict):
+        response = await client.chat(model=self.model, messages=[{"role": "user", "content": prompt}],
+                                     format=_json_schema(schema), options=self._options(method))
+        return response['message']['content'], response.get('done_reason')
+
+    async def multi_analysis(self, text: str, elements: list, genre: str = "Fiction") -> dict:
+        """Review the text and analyze each element concurrently.
+
+        Returns results keyed by (method, element) in request order; the review's element is
+        None. A call that failed maps to its exception instead of a result dict.
+        """
+        jobs = {("review_writing", None): ((text, genre), self._review_prompt(text, genre), REVIEW_SCHEMA)}
+        for element in elements:
+            jobs[("analyze_element", element)] = ((text, element), self._element_prompt(text, element),
+                                                  ANALYZE_SCHEMA)
+
+        results, pending = dict.fromkeys(jobs), {}
+        for job, (args, prompt, schema) in jobs.items():
+            method = job[0]
+            func = getattr(CreativeWritingCoach, method).__wrapped__
+            key = self.cache.make_key(self.model, method, _args_key(func, args, {}))
+            hit = self.cache.get(key)
+            if hit is not None:
+                results[job] = hit
+            else:
+                pending[job] = (key, prompt, schema)
+
+        # One client per batch: its connection pool is bound to the running event loop.
+        # Closed by hand because AsyncClient only supports "async with" from ollama 0.6.2.
+        client = ollama.AsyncClient()
         try:
-            start = content.find('{')
-            end = content.rfind('}') + 1
-            if start != -1 and end > start:
-                return json.loads(content[start:end])
-        except:
-            pass
-        return {"raw_response": content}
+            contents = await asyncio.gather(*(self._chat_async(client, prompt, method, schema)
+                                              for (method, _), (_, prompt, schema) in pending.items()),
+                                            return_exceptions=True)
+        finally:
+            await client._client.aclose()
+        for ((method, element), (key, _, schema)), content in zip(pending.items(), contents):
+            if isinstance(content, Exception):
+                results[(method, element)] = content
+                continue
+            result = self._parse_response(*content, schema)
+            if _cacheable(result):
+                self.cache.set(key, result)
+                if element is not None:
+                    self._store_shared_sections(ELEMENT_TEMPLATE, result, element=element)
+            if element is None:
+                self.submissions.append({"text": text[:500], "review": result})
+            results[(method, element)] = result
+        return results
 
+    def prefetch_elements(self, text: str, review: dict, count: int = 2):
+        """Analyze the lowest-scoring craft elements of a review in the background."""
+        if "raw_response" in review:
+            return
+        craft = review["craft_analysis"]
+        scored = [(info["score"], name) for name, info in craft.items()
+                  if isinstance(info, dict) and isinstance(info.get("score"), (int, float))]
+        # Finished prefetches are already in the cache; only pending ones need tracking.
+        self._prefetches = {key: future for key, future in self._prefetches.items() if not future.done()}
+        for _, name in sorted(scored)[:count]:
+            element = canonical_element(name)
+            key = self._prefetch_key(text, element)
+            if key not in self._prefetches:
+                self._prefetches[key] = self._prefetch_pool.submit(self._prefetch, text, element)
 
-def display_menu():
+    def wait_for_prefetch(self, text: str, element: str):
+        """Block until a pending prefetch for this text/element lands in the cache."""
+        future = self._prefetches.pop(self._prefetch_key(text, element), None)
+        if future is not None:
+            wait([future])
+
+    def close(self):
+        """Cancel background prefetches, wait for their workers, then release the client."""
+        if self._closing.is_set():
+            return
+        self._closing.set()
+        self._prefetch_pool.shutdown(wait=True, cancel_futures=True)
+        if hasattr(self._client, "close"):
+            self._client.close()
+
+    @staticmethod
+    def _prefetch_key(text: str, element: str):
+        return blake2b(_normalize(text).encode("utf-8")).hexdigest(), element
+
+    def _prefetch(self, text: str, element: str):
+        # Streaming lets a closing coach abort the model call between chunks.
+        self._check_closing()
+        self.analyze_element(text, element, on_chunk=self._check_closing)
+
+    def _check_closing(self, _piece: str = ""):
+        if self._closing.is_set():
+            raise PrefetchCancelled()
+
+    def _shared_sections(self, template: PromptTemplate, **slots):
+        """Return cached text-independent response fields for these slot values, if any."""
+        if not template.shared_fields:
+            return None
+        key = self.cache.make_key(self.model, f"{template.method}:shared", template.slot_key(**slots))
+        return self.cache.get(key)
+
+    def _store_shared_sections(self, template: PromptTemplate, result: dict, **slots):
+        if (not template.shared_fields or not _cacheable(result)
+                or not all(result.get(f) for f in template.shared_fields)):
+            return
+        key = self.cache.make_key(self.model, f"{template.method}:shared", template.slot_key(**slots))
+        self.cache.set(key, {f: result[f] for f in template.shared_fields})
+
+    def _options(self, method: str) -> dict:
+        return {"num_predict": BUDGET[method], **SAMPLING_OPTIONS}
+
+    def _ask(self, prompt: str, method: str, schema: dict, on_chunk=None) -> dict:
+        return self._parse_response(*self._chat(prompt, method, schema, on_chunk), schema)
+
+    def _parse_response(self, content: str, done_reason, schema: dict) -> dict:
+        result = self._parse_json(content, schema)
+        if done_reason == "length":
+            # Cut off at num_predict: repair would make a partial answer look complete.
+            result["truncated"] = True
+        return result
+
+    def _chat(self, prompt: str, method: str, schema: dict, on_chunk=None):
+        """Send a prompt to the model and return (content, done_reason).
+
+        Each content chunk is streamed to on_chunk if given.
+        """
+        messages = [{"role": "user", "content": prompt}]
+        kwargs = {"format": _json_schema(schema), "options": self._options(method)}
+        if on_chunk is None:
+            response = self._client.chat(model=self.model, messages=messages, **kwargs)
+            return response['message']['content'], response.get('done_reason')
+        content, done_reason = "", None
+        for chunk in self._client.chat(model=self.model, messages=messages, stream=True, **kwargs):
+            piece = chunk['message']['content']
+            content += piece
+            done_reason = chunk.get('done_reason') or done_reason
+            on_chunk(piece)
+        return content, done_reason
+
+    def _parse_json(self, content: str, schema: dict) -> dict:
+        start = content.find('{')
+        if start == -1:
+            return {**_conform({}, schema), "raw_response": content}
+        # Walk forward once, tracking strings, to find the brace closing the first object.
+        depth, in_string, escaped, end = 0, False, False, len(content)
+        for i in range(start, len(content)):
+            c = content[i]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif c == '\\':
+                    escaped = True
+                elif c == '"':
+                    in_string = False
+            elif c == '"':
+                in_string = True
+            elif c == '{':
+                depth += 1
+            elif c == '}':
+                depth -= 1
+                if depth == 0:
+                    end = i + 1
+                    break
+        try:
+            result = _loads(content[start:end])
+        except json.JSONDecodeError:
+            # Trailing commas, unquoted keys, truncated output and the like.
+            result = repair_json(content[start:end], return_objects=True)
+        # An object with none of the expected keys (e.g. wrapped in {"review": ...}) is no answer.
+        if not isinstance(result, dict) or not result.keys() & schema.keys():
+            return {**_conform({}, schema), "raw_response": content}
+        return _conform(result, schema)
+
+
+def _build_menu_table() -> Table:
     table = Table(title="✨ Creative Writing Coach", show_header=True)
     table.add_column("Option", style="cyan", width=6)
     table.add_column("Feature", style="green")
@@ -252,93 +686,147 @@ def display_menu():
     table.add_row("4", "Expand Scene", "Develop a scene")
     table.add_row("5", "Dialogue Coach", "Improve dialogue")
     table.add_row("6", "View Elements", "See writing elements")
+    table.add_row("7", "Batch Analyze", "Review + several elements at once")
     table.add_row("0", "Exit", "Close application")
-    
-    console.print(table)
+    return table
+
+
+# The menu and banner never change, so they are built once and reprinted.
+_MENU_TABLE = _build_menu_table()
+
+_WELCOME_PANEL = Panel.fit(
+    "[bold blue]✨ Creative Writing Coach[/bold blue]\n"
+    "[green]AI-Powered Creative Writing Feedback[/green]\n"
+    "[dim]Author: Pranay M[/dim]",
+    border_style="blue"
+)
+
+_JSON_FENCE = "```json\n{}\n```"
+
+
+def display_menu():
+    console.print(_MENU_TABLE)
+
+
+def read_block(prompt: str = "Paste your writing (end with 'EOF' or Ctrl-D):") -> str:
+    """Read pasted lines until an 'EOF' line or the end of input."""
+    console.print(f"[dim]{prompt}[/dim]")
+    lines = []
+    if not sys.stdin.isatty():
+        for line in iter(sys.stdin.readline, ""):
+            if line.strip() == "EOF":
+                break
+            lines.append(line.rstrip("\n"))
+        return "\n".join(lines)
+    try:
+        while True:
+            line = input()
+            if line.strip() == "EOF":
+                break
+            lines.append(line)
+    except EOFError:
+        pass
+    return "\n".join(lines)
+
+
+def show_result(title: str, result: dict):
+    console.print(Panel(Markdown(_JSON_FENCE.format(_pretty(result))), title=title))
+    if result.get("truncated"):
+        console.print("[yellow]The response hit its length limit and may be incomplete; "
+                      "it was not cached.[/yellow]")
+
+
+def stream_result(title: str, method, *args) -> dict:
+    """Run a coach method, rendering the response in a live panel as it streams in."""
+    buffer = ""
+
+    with Live(Panel("[bold green]Analyzing your writing...", title=title), console=console,
+              refresh_per_second=15, transient=True) as live:
+        def on_chunk(piece: str):
+            nonlocal buffer
+            buffer += piece
+            live.update(Panel(Markdown(_JSON_FENCE.format(buffer)), title=title))
+
+        result = method(*args, on_chunk=on_chunk)
+
+    show_result(title, result)
+    return result
 
 
 def main():
-    console.print(Panel.fit(
-        "[bold blue]✨ Creative Writing Coach[/bold blue]\n"
-        "[green]AI-Powered Creative Writing Feedback[/green]\n"
-        "[dim]Author: Pranay M[/dim]",
-        border_style="blue"
-    ))
+    parser = argparse.ArgumentParser(description="Creative Writing Coach")
+    parser.add_argument("--quality", choices=sorted(QUALITY_MODELS), default="fast",
+                        help="fast uses a q4 quantized model, high the fp16 weights")
+    parser.add_argument("--model", help="Ollama model to use (overrides --quality)")
+    args = parser.parse_args()
+
+    console.print(_WELCOME_PANEL)
     
-    coach = CreativeWritingCoach()
+    coach = CreativeWritingCoach(model=args.model or QUALITY_MODELS[args.quality])
     
-    while True:
-        display_menu()
-        choice = Prompt.ask("\n[cyan]Select option[/cyan]", default="0")
+    try:
+        while True:
+            display_menu()
+            choice = Prompt.ask("\n[cyan]Select option[/cyan]", default="0")
         
-        if choice == "0":
-            console.print("[yellow]Goodbye! Keep writing! ✨[/yellow]")
-            break
+            if choice == "0":
+                console.print("[yellow]Goodbye! Keep writing! ✨[/yellow]")
+                break
         
-        elif choice == "6":
-            console.print("\n[bold]Writing Elements:[/bold]")
-            for element in WRITING_ELEMENTS:
-                console.print(f"  • {element}")
-            console.print("\n[bold]Genres:[/bold]")
-            for genre in GENRES:
-                console.print(f"  • {genre}")
-            continue
+            elif choice == "6":
+                console.print("\n[bold]Writing Elements:[/bold]")
+                for element in WRITING_ELEMENTS:
+                    console.print(f"  • {element}")
+                console.print("\n[bold]Genres:[/bold]")
+                for genre in GENRES:
+                    console.print(f"  • {genre}")
+                continue
         
-        with console.status("[bold green]Analyzing your writing..."):
             if choice == "1":
-                console.print("[dim]Paste your writing (end with 'EOF'):[/dim]")
-                lines = []
-                while True:
-                    line = input()
-                    if line.strip() == "EOF":
-                        break
-                    lines.append(line)
+                text = read_block()
                 genre = Prompt.ask("Genre", default="Fiction")
-                result = coach.review_writing("\n".join(lines), genre)
-                console.print(Panel(Markdown(f"```json\n{json.dumps(result, indent=2)}\n```"),
-                                   title="📖 Writing Review"))
-            
+                result = stream_result("📖 Writing Review", coach.review_writing, text, genre)
+                coach.prefetch_elements(text, result)
+        
             elif choice == "2":
-                console.print("[dim]Paste your writing (end with 'EOF'):[/dim]")
-                lines = []
-                while True:
-                    line = input()
-                    if line.strip() == "EOF":
-                        break
-                    lines.append(line)
-                element = Prompt.ask("Element to analyze", default="Voice")
-                result = coach.analyze_element("\n".join(lines), element)
-                console.print(Panel(Markdown(f"```json\n{json.dumps(result, indent=2)}\n```"),
-                                   title=f"🔍 {element} Analysis"))
-            
+                text = read_block()
+                element = canonical_element(Prompt.ask("Element to analyze", default="Voice"))
+                with console.status("[bold green]Finishing background analysis..."):
+                    coach.wait_for_prefetch(text, element)
+                stream_result(f"🔍 {element} Analysis", coach.analyze_element, text, element)
+        
             elif choice == "3":
                 genre = Prompt.ask("Genre", default="Fiction")
                 theme = Prompt.ask("Theme (optional)", default="")
                 constraints = Prompt.ask("Constraints (optional)", default="")
-                result = coach.generate_prompt(genre, theme, constraints)
-                console.print(Panel(Markdown(f"```json\n{json.dumps(result, indent=2)}\n```"),
-                                   title="💡 Writing Prompt"))
-            
+                stream_result("💡 Writing Prompt", coach.generate_prompt, genre, theme, constraints)
+        
             elif choice == "4":
                 scene = Prompt.ask("Describe your scene briefly")
-                result = coach.expand_scene(scene)
-                console.print(Panel(Markdown(f"```json\n{json.dumps(result, indent=2)}\n```"),
-                                   title="🎬 Expanded Scene"))
-            
+                stream_result("🎬 Expanded Scene", coach.expand_scene, scene)
+        
             elif choice == "5":
-                console.print("[dim]Paste dialogue (end with 'EOF'):[/dim]")
-                lines = []
-                while True:
-                    line = input()
-                    if line.strip() == "EOF":
-                        break
-                    lines.append(line)
+                dialogue = read_block("Paste dialogue (end with 'EOF' or Ctrl-D):")
                 context = Prompt.ask("Context", default="")
-                result = coach.dialogue_coach("\n".join(lines), context)
-                console.print(Panel(Markdown(f"```json\n{json.dumps(result, indent=2)}\n```"),
-                                   title="💬 Dialogue Feedback"))
+                stream_result("💬 Dialogue Feedback", coach.dialogue_coach, dialogue, context)
+        
+            elif choice == "7":
+                text = read_block()
+                genre = Prompt.ask("Genre", default="Fiction")
+                elements = Prompt.ask("Elements to analyze (comma-separated)", default="Voice, Dialogue")
+                elements = [canonical_element(e) for e in elements.split(",") if e.strip()]
+                with console.status("[bold green]Analyzing your writing..."):
+                    results = asyncio.run(coach.multi_analysis(text, elements, genre))
+                for (_, element), result in results.items():
+                    title = "📖 Writing Review" if element is None else f"🔍 {element} Analysis"
+                    if isinstance(result, Exception):
+                        console.print(Panel(f"[red]{result}[/red]", title=title, border_style="red"))
+                    else:
+                        show_result(title, result)
         
-        console.print("\n" + "="*50)
+            console.print("\n" + "="*50)
+    finally:
+        coach.close()
 
 
 if __name__ == "__main__":